@@ -8,22 +8,84 @@ NOTE: these objects are attached to the top level ``dimcli`` module. So you can
 """
 
 
+import os
+import re
 import requests
 import time
+import random
 import json
 import IPython.display
 from itertools import islice
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
-import pandas as pd
+try:
+    import orjson # optional: faster JSON decoding
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+try:
+    import ijson # optional: parse large responses incrementally
+except ImportError:
+    ijson = None
 
 from .auth import get_global_connection 
 from .dsl_grammar import G
-from .dataframe_factory import DfFactory
 
 from ..utils.all import *
 
 
+# retry policy for Dsl.query: exponential backoff with jitter, in seconds
+QUERY_MAX_ATTEMPTS = 8
+RETRY_BACKOFF_BASE = 2
+RETRY_BACKOFF_MAX = 30
+
+# set this env variable to '1' to check `search` queries against the API schema before sending them 
+VALIDATE_QUERIES_ENV = "DIMCLI_VALIDATE_QUERIES"
+
+# DSL string literals, including escaped quotes eg "\"return to work\""
+_STRING_RE = re.compile(r'"(?:\\.|[^"\\])*"')
+# result type of each `return` statement, once quoted text has been removed eg `return in  funders`
+_RETURN_RE = re.compile(r'\breturn\s+(?:in\s+)?(\w+)')
+
+# responses bigger than this (compressed bytes) get streamed, if ijson is installed
+STREAM_MIN_BYTES = 512 * 1024
+
+
+def _retry_delay(attempt, response=None):
+    """Seconds to wait before retrying a request. 
+    
+    Use the server `Retry-After` header if available, otherwise an exponential backoff with jitter, so that concurrent clients don't all retry at the same time.
+    """
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return max(float(retry_after), 0)
+            except ValueError:
+                pass # HTTP-date format: fall back to backoff
+    delay = min(RETRY_BACKOFF_BASE * 2 ** attempt, RETRY_BACKOFF_MAX)
+    return delay * (1 + random.uniform(0, 0.5))
+
+
+def _parse_json_response(response):
+    """Decode the JSON body of a streamed API response.
+
+    Large responses (or responses of unknown size) are parsed while being downloaded, if the optional `ijson` library is installed, 
+    so the raw payload is never held in memory alongside the decoded data. 
+    Everything else is decoded in one go, using `orjson` if available.
+    """
+    if ijson is not None:
+        size = response.headers.get("Content-Length")
+        if not size or int(size) > STREAM_MIN_BYTES:
+            response.raw.decode_content = True # urllib3 gunzips the stream on the fly
+            try:
+                return next(ijson.items(response.raw, "", use_float=True))
+            finally:
+                response.close()
+    return _loads(response.content)
+
 
 class Dsl():
 
@@ -78,7 +140,6 @@ class Dsl():
         self._show_results = show_results
         self._verbose = verbose
         self._url = None
-        self._headers = None
         if auth_session:
             self._CONNECTION = auth_session 
         else:
@@ -87,13 +148,17 @@ class Dsl():
         if self._CONNECTION.token:
             # if already logged in, reuse connection          
             self._url = self._CONNECTION.url
-            self._headers = {'Authorization': "JWT " + self._CONNECTION.token}
         else:
             self._print_please_login()
 
+    @property
+    def _session(self):
+        "The HTTP session of the API connection: pooled keep-alive connections, with the auth header already set"
+        return self._CONNECTION.http
+
     @property
     def is_logged_in(self):
-        if self._url and  self._headers: return True
+        if self._url and self._CONNECTION.token: return True
         else: return False
 
     def _print_please_login(self):
@@ -103,21 +168,29 @@ class Dsl():
         if self._CONNECTION:
             self._CONNECTION.refresh_login()
             self._url = self._CONNECTION.url
-            self._headers = {'Authorization': "JWT " + self._CONNECTION.token}
         else:
             printDebug("Warning: please login first.")
 
+    def close(self):
+        """Close the pooled HTTP connections used for querying. 
+        
+        The session remains usable afterwards: new connections are opened on demand.
+        """
+        self._session.close()
+
     def query(self, q, show_results=None, retry=0, verbose=None):
         """Execute a single DSL query.
 
-        This method handles the query token from the API and regenerates it if it's expired. If the API throws a 'Too Many Requests for the Server' error, the method sleeps 30 seconds before retrying.
+        This method handles the query token from the API and regenerates it if it's expired. If the API throws a 'Too Many Requests for the Server' error, the method waits before retrying, either as long as the server `Retry-After` header says, or using an exponential backoff with jitter. The total number of attempts is capped by `QUERY_MAX_ATTEMPTS`: after that, a `requests.HTTPError` is raised.
+
+        If the `DIMCLI_VALIDATE_QUERIES` environment variable is set to '1', `search` queries are first checked against the API schema (retrieved once per connection via `describe schema`): queries with an unknown source or result type are not sent to the server, and a DslDataset containing the error is returned instead.
 
         Parameters
         ----------
         show_results : bool, default=None
             Setting that determines whether the query JSON results should be printed out. If None, it inherits from the Dsl global setting. Note that in Jupyter environments this is not needed, because iPython rich widgets are used by default.
         retry : int, default=0
-            Number of times to retry the query if it fails.
+            Number of times to retry the query if it fails with an unexpected HTTP status.
         verbose : bool, default=None
             Verbose mode. If None, it inherits from the Dsl global setting. 
 
@@ -140,66 +213,125 @@ class Dsl():
 
         if verbose == None:
             verbose = self._verbose
+
+        if os.environ.get(VALIDATE_QUERIES_ENV, "").lower() in ("1", "true", "yes"):
+            error = self._validate_query(q)
+            if error:
+                result = DslDataset({
+                    "errors": {"query": {"header": "Client-side validation error (set %s=0 to disable):\n" % VALIDATE_QUERIES_ENV, "details": [error]}},
+                    "code": "client.invalid_query",
+                })
+                print_json_errors(result) # ALWAYS print errors
+                return result
         
         #   Execute DSL query.
         start = time.time()
-        response = requests.post(self._url, data=q.encode(), headers=self._headers)
-        if response.status_code == 429:  
-            # Too Many Requests
-            printDebug(
-                'Too Many Requests for the Server. Sleeping for 30 seconds and then retrying.'
-            )
-            time.sleep(30)
-            return self.query(q, show_results, retry, verbose)
-        elif response.status_code == 403:  
-            # Forbidden:
-            printDebug('Login token expired. Logging in again.')
-            self._refresh_login()
-            # self._CONNECTION.refresh_login()
-            # self._url = self._CONNECTION.url
-            # self._headers = {'Authorization': "JWT " + self._CONNECTION.token}
-            return self.query(q, show_results, retry, verbose)
-        elif response.status_code in [200, 400, 500]:  
-            ###  
-            # OK or Error Info :-)
-            ###
-            try:
-                res_json = response.json()
-            except:
-                printDebug('Unexpected error. JSON could not be parsed.')
-                return response
-            result = DslDataset(res_json)
-            end = time.time()
-            elapsed = end - start
-            if verbose: print_json_stats(result, q, elapsed)
-            print_json_errors(result) # ALWAYS print errors
-            if verbose: print_json_warnings(result) # DON'T print warnings unless verbose=True
-            if show_results or (show_results is None and self._show_results):
-                IPython.display.display(result)
-            return result
-        else:
-            if retry > 0:
-                printDebug('Retrying in 30 secs')
-                time.sleep(30)
-                return self.query(
-                    q,
-                    show_results,
-                    retry - 1, 
-                    verbose)
+        for attempt in range(QUERY_MAX_ATTEMPTS):
+            response = self._session.post(self._url, data=q.encode(), stream=True)
+            if response.status_code == 429:  
+                # Too Many Requests
+                response.content # read the body, so the connection goes back to the pool
+                if attempt == QUERY_MAX_ATTEMPTS - 1:
+                    break # no more attempts: don't wait before failing
+                delay = _retry_delay(attempt, response)
+                printDebug(
+                    'Too Many Requests for the Server. Sleeping for %.1f seconds and then retrying.' % delay
+                )
+                time.sleep(delay)
+            elif response.status_code == 403:  
+                # Forbidden:
+                response.content
+                printDebug('Login token expired. Logging in again.')
+                self._refresh_login()
+            elif response.status_code in [200, 400, 500]:  
+                ###  
+                # OK or Error Info :-)
+                ###
+                try:
+                    res_json = _parse_json_response(response)
+                except:
+                    printDebug('Unexpected error. JSON could not be parsed.')
+                    return response
+                result = DslDataset(res_json)
+                end = time.time()
+                elapsed = end - start
+                if verbose: print_json_stats(result, q, elapsed)
+                print_json_errors(result) # ALWAYS print errors
+                if verbose: print_json_warnings(result) # DON'T print warnings unless verbose=True
+                if show_results or (show_results is None and self._show_results):
+                    IPython.display.display(result)
+                return result
+            elif retry > 0 and attempt < QUERY_MAX_ATTEMPTS - 1:
+                retry -= 1
+                response.content
+                delay = _retry_delay(attempt, response)
+                printDebug('Retrying in %.1f secs' % delay)
+                time.sleep(delay)
             else:
-                if verbose: printDebug("ERROR LOG\n---\nQuery\n---\n" + str(q), "red")
-                if verbose: printDebug("Response.header\n---\n" + str(response.headers), "red")
-                if verbose: printDebug("Response.content\n---\n" +str(response.content), "red")
-                response.raise_for_status()
+                break
+
+        if verbose: printDebug("ERROR LOG\n---\nQuery\n---\n" + str(q), "red")
+        if verbose: printDebug("Response.header\n---\n" + str(response.headers), "red")
+        if verbose: printDebug("Response.content\n---\n" +str(response.content), "red")
+        response.raise_for_status()
 
 
 
-    def query_iterative(self, q, show_results=None, limit=1000, skip=0, pause=1.5, force=False, maxlimit=0, verbose=None, _tot_count_prev_query=0, _warnings_tot=None):       
+    def _get_schema(self):
+        """Return the JSON data of a `describe schema` query. 
+        
+        The schema doesn't change within a session, so it is retrieved only once per API connection (`dimcli.logout()` discards it).
+        """
+        if self._CONNECTION.schema is None:
+            res = self.query("describe schema", show_results=False, verbose=False)
+            if res['errors']:
+                raise Exception("Could not retrieve the DSL schema: " + res.errors_string)
+            self._CONNECTION.schema = res.json
+        return self._CONNECTION.schema
+
+
+    def _validate_query(self, q):
+        """Check a `search` query against the API schema, so that obvious mistakes don't need a round trip to the server. 
+
+        Only unknown sources and missing or unknown `return` result types are detected. Other queries are never rejected, 
+        and neither is any query if the schema can't be retrieved.
+
+        Returns
+        -------
+        str
+            An error message, or None if no problems were found.
+        """
+        if not line_is_search_query(q):
+            return None
+        try:
+            sources = self._get_schema()['sources']
+        except Exception:
+            return None # let the server check the query
+        source = line_search_subject(q)
+        if source not in sources:
+            return f"Unknown source '{source}'. Should be one of: {', '.join(sorted(sources))}"
+        unquoted = _STRING_RE.sub("", q)
+        if '"' in unquoted:
+            return None # unbalanced quotes: let the server report it
+        returns = _RETURN_RE.findall(unquoted)
+        if not returns:
+            return f"Missing `return` statement, eg `return {source}`"
+        facets = [x for x, specs in sources[source]['fields'].items() if specs.get('is_facet')]
+        allowed = set(sources) | set(facets)
+        for r in returns:
+            if r not in allowed:
+                return f"Unknown result type for {source}: '{r}'"
+        return None
+
+
+    def query_iterative(self, q, show_results=None, limit=1000, skip=0, pause=1.5, force=False, maxlimit=0, verbose=None, workers=1, _tot_count_prev_query=0, _warnings_tot=None):       
         """Runs a DSL query and then keep querying until all matching records have been extracted. 
         
         The API returns a maximum of 1000 records per call. If a DSL query results in more than 1000 matches, it is possible to use pagination to get more results. 
         
         Iterative querying works by automatically paginating through all records available for a result set. The original query gets turned into a loop that uses the `limit` / `skip` operators until all the results available have been extracted. 
+
+        If a page keeps failing with an HTTP error even after retrying (eg because of rate limiting, see `query`), the `requests.HTTPError` is raised and the iteration stops.
         
         Parameters
         ----------
@@ -219,6 +351,8 @@ class Dsl():
             The maximum number of records to extract in total. If 0, all available records are extracted, up to the API upper limit of 50k records per query.
         verbose : bool, default=False
             Verbose mode.
+        workers : int, default=1
+            How many pages to request concurrently. With values greater than 1, the first page is used to get the total number of records, then all remaining pages are requested in parallel by a pool of threads. Not supported by `unnest` queries, which are always extracted sequentially. Note: API rate limits still apply, throttled requests are retried automatically.
 
 
         Returns
@@ -281,6 +415,15 @@ class Dsl():
             # first iteration
             # if verbose: printDebug(f"{limit+skip} / ...")
             if verbose: printDebug(f"Starting iteration with limit={limit} skip={skip} ...")
+
+            if workers > 1 and not IS_UNNEST:
+                pages = self._query_pages_concurrently(q, sourcetype, limit, skip, pause, force, MAXLIMIT, verbose, workers)
+                if isinstance(pages, DslDataset):
+                    return pages # error 
+                elif pages:
+                    output, tot, _warnings_tot = pages
+                    return self._iterative_dataset(sourcetype, output, tot, _warnings_tot, show_results, verbose)
+                # else: can't plan the pages, continue sequentially
             
         output, flag_force = [], False
         q2 = q + " limit %d skip %d" % (limit, skip)
@@ -322,15 +465,15 @@ class Dsl():
                 _warnings_tot = res["_warnings"]
 
         if flag_force:
-            output = self.query_iterative(q, show_results, limit, new_skip, pause, force, maxlimit, verbose, _tot_count_prev_query, _warnings_tot)                    
+            output = self.query_iterative(q, show_results, limit, new_skip, pause, force, maxlimit, verbose, _tot_count_prev_query=_tot_count_prev_query, _warnings_tot=_warnings_tot)                    
 
         elif not IS_UNNEST and len(res[sourcetype]) == limit and not flag_last_round:
-            output = res[sourcetype] + self.query_iterative(q, show_results, limit, new_skip, pause, force,maxlimit, verbose, tot, _warnings_tot)
+            output = res[sourcetype] + self.query_iterative(q, show_results, limit, new_skip, pause, force,maxlimit, verbose, _tot_count_prev_query=tot, _warnings_tot=_warnings_tot)
 
         elif IS_UNNEST and len(res[sourcetype]) > 0 and not flag_last_round:
             # unnest returns a number of records that don't relate to actual data left
             # hence can't match the lenght of results to limit in this case
-            output = res[sourcetype] + self.query_iterative(q, show_results, limit, new_skip, pause, force, maxlimit, verbose, tot, _warnings_tot)
+            output = res[sourcetype] + self.query_iterative(q, show_results, limit, new_skip, pause, force, maxlimit, verbose, _tot_count_prev_query=tot, _warnings_tot=_warnings_tot)
 
         else:
             output = res[sourcetype]
@@ -343,23 +486,88 @@ class Dsl():
         #   just return current iteration results 
         #
         if skip == 0: 
-            response_simulation = {
-                "_stats": {
-                    "total_count": tot or len(output)  # fallback..
-                    },
-                sourcetype: output
-            }
-            if _warnings_tot:
-                response_simulation["_warnings"] = _warnings_tot
-            result = DslDataset(response_simulation)
-            if show_results or (show_results is None and self._show_results):
-                IPython.display.display(result)
-            if verbose: printDebug(f"===\nRecords extracted: {len(output)}")
-            return result
+            return self._iterative_dataset(sourcetype, output, tot, _warnings_tot, show_results, verbose)
         else:
             return output
 
 
+    def _iterative_dataset(self, sourcetype, output, tot, warnings, show_results, verbose):
+        """Build the DslDataset returned by an iterative query, from the merged records of all iterations."""
+        response_simulation = {
+            "_stats": {
+                "total_count": tot or len(output)  # fallback..
+                },
+            sourcetype: output
+        }
+        if warnings:
+            response_simulation["_warnings"] = warnings
+        result = DslDataset(response_simulation)
+        if show_results or (show_results is None and self._show_results):
+            IPython.display.display(result)
+        if verbose: printDebug(f"===\nRecords extracted: {len(output)}")
+        return result
+
+
+    def _query_pages_concurrently(self, q, sourcetype, limit, skip, pause, force, maxlimit, verbose, workers):
+        """Extract all the pages of an iterative query using a pool of threads. 
+
+        The first page is used to get the total number of records, then the remaining pages are requested `workers` at a time. 
+        Each request goes through `query`, so throttled requests (429) back off with jitter independently.
+
+        Returns a tuple (records, total_count, warnings) with records merged in offset order. If a page fails and `force` is False, 
+        the DslDataset containing the error is returned instead. If the first page fails and `force` is True, returns None.
+        If a request raises (eg a `requests.HTTPError`), the pages not yet started are cancelled and the exception is re-raised.
+        """
+        def fetch(page_skip, page_limit):
+            start = time.time()
+            res = self.query(q + " limit %d skip %d" % (page_limit, page_skip), show_results=False, retry=0, verbose=False)
+            elapsed = time.time() - start
+            if elapsed < 2:
+                time.sleep(pause)
+            return res, elapsed
+
+        res, elapsed = fetch(skip, limit)
+        if res['errors']:
+            if force:
+                return None
+            printDebug(f"\n>>>[Dimcli tip] An error occurred with the batch '{skip}-{limit+skip}'. Consider using the 'limit' argument to retrieve fewer records per iteration, or use 'force=True' to ignore errors and continue the extraction.")
+            return res
+
+        tot = int(res['stats']['total_count'])
+        end = min(tot, maxlimit)
+        offsets = list(range(skip + limit, end, limit))
+        pages = [(skip, res, elapsed)]
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(fetch, x, min(limit, end - x)) for x in offsets]
+            for x, future in zip(offsets, futures):
+                try:
+                    res, elapsed = future.result()
+                except Exception:
+                    # eg HTTPError: don't wait for the queued pages before raising
+                    for f in futures:
+                        f.cancel()
+                    raise
+                if res['errors'] and not force:
+                    for f in futures:
+                        f.cancel()
+                    printDebug(f"\n>>>[Dimcli tip] An error occurred with the batch '{x}-{limit+x}'. Consider using the 'limit' argument to retrieve fewer records per iteration, or use 'force=True' to ignore errors and continue the extraction.")
+                    return res
+                pages.append((x, res, elapsed))
+
+        output, warnings = [], []
+        for x, res, elapsed in pages:
+            if res['errors']:
+                printDebug(f"\n>>>[Dimcli log] An error occurred with the batch '{x}-{limit+x}'. Skipping this batch and continuing iteration.. ")
+                continue
+            if verbose:
+                t = "%.2f" % elapsed
+                printDebug(f"{x}-{min(x + limit, tot)} / {tot} ({t}s)")
+            output += res[sourcetype]
+            warnings += res["_warnings"]
+        return output, tot, warnings
+
+
     def __repr__(self):
         return f"<dimcli.Dsl #{id(self)}. API endpoint: {self._url}>"
 
@@ -532,6 +740,7 @@ class DslDataset(IPython.display.JSON):
     def _from_any_list(cls, data, source_type):
         """Generic method that allows to simulate an API results DslDataset object from raw data.
         """
+        import pandas as pd
         if type(data) == list:
             return cls({source_type : data, '_stats' : {'total_count' : len(data)}})
         elif type(data) == pd.DataFrame:
@@ -584,7 +793,15 @@ class DslDataset(IPython.display.JSON):
 
 
     def __init__(self, data):
-        IPython.display.JSON.__init__(self, data)
+        if isinstance(data, dict):
+            # just keep a reference to the API data: skip DisplayObject's url/file sniffing and reloading
+            # NOTE the JSON widget data is built only when rendered, via `_repr_json_` 
+            self.url = None
+            self.filename = None
+            self.metadata = {'expanded': False, 'root': 'root'}
+            self.data = data
+        else:
+            IPython.display.JSON.__init__(self, data)
         self.json = self.data
         self.errors = None
         for k in self.json.keys(): # add result dict keys as attributes dynamically
@@ -593,17 +810,22 @@ class DslDataset(IPython.display.JSON):
             else:
                 setattr(self, k, self.json[k])
 
-        self.df_factory = DfFactory(good_data_keys=self.good_data_keys())
+        self._df_factory = None
+
+    @property
+    def df_factory(self):
+        "The dataframes builder: created on first use, so that pandas gets loaded only when dataframes are needed"
+        if self._df_factory is None:
+            from .dataframe_factory import DfFactory
+            self._df_factory = DfFactory(good_data_keys=self.good_data_keys())
+        return self._df_factory
 
     def __getitem__(self, key):
         "Trick to return any dict key as a property"
         # printDebug(key, "==========")
         if key == "stats":
             key = "_stats" # syntactic sugar
-        if key in self.json:
-            return self.json[key]
-        else:
-            return [] # empty list so to support iteration tests / previously: False
+        return self.json.get(key, []) # empty list so to support iteration tests / previously: False
 
     def __len__(self):
         "Return length of first object in JSON"
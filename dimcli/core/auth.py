@@ -1,5 +1,7 @@
 import configparser
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os.path
 import os
 import sys
@@ -24,6 +26,31 @@ USER_EXPORTS_DIR = os.path.expanduser("~/dimcli-exports/")
 USER_SETTINGS_FILE_NAME = "settings"
 USER_SETTINGS_FILE_PATH = os.path.expanduser(USER_DIR + USER_SETTINGS_FILE_NAME)
 
+# HTTP connection pool sizes (per API session)
+POOL_CONNECTIONS = 4
+POOL_MAXSIZE = 16
+
+# compressed responses: brotli is used only if a decoder is installed (urllib3 needs it)
+try:
+    import brotli
+except ImportError:
+    brotli = None
+ACCEPT_ENCODING = "gzip, br" if brotli else "gzip, deflate"
+
+# gateway errors get retried transparently by the connection pool
+# NOTE 500 is excluded as the DSL uses it to return JSON error messages; 429 is handled by Dsl.query
+RETRY_STATUSES = [502, 503, 504]
+
+
+def _gateway_retries():
+    "Retry policy for the HTTP adapter, compatible with older urllib3 versions"
+    options = dict(total=3, backoff_factor=1, status_forcelist=RETRY_STATUSES, 
+                    respect_retry_after_header=False, raise_on_status=False)
+    try:
+        return Retry(allowed_methods=False, **options) # urllib3 >= 1.26
+    except TypeError:
+        return Retry(method_whitelist=False, **options)
+
 
 
 ###
@@ -74,9 +101,27 @@ class APISession():
         self.password = None
         self.key = None
         self.token = None
+        self.schema = None # `describe schema` results, fetched on demand by Dsl objects
+        self._http = None
         # self._verbose = verbose
 
 
+    @property
+    def http(self):
+        """The requests Session used for all API calls made via this APISession. 
+
+        Connections are pooled and kept alive, so that subsequent queries don't have to pay for a new TCP/TLS handshake.
+        """
+        if self._http is None:
+            self._http = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, pool_block=False, 
+                                    max_retries=_gateway_retries())
+            self._http.mount("https://", adapter)
+            self._http.mount("http://", adapter)
+            self._http.headers.update({"Accept-Encoding": ACCEPT_ENCODING, "Connection": "keep-alive"})
+        return self._http
+
+
     def login(self, 
                 instance="", 
                 username="", 
@@ -133,11 +178,11 @@ class APISession():
             try:
                 username = config_section['login']
                 password = config_section['password']
-            except:
+            except KeyError:
                 username, password = "", ""
             try:
                 key = config_section['key']
-            except:
+            except KeyError:
                 key = ""
 
         URL_AUTH, URL_QUERY = self._get_endpoint_urls(endpoint)
@@ -146,7 +191,7 @@ class APISession():
         login_data = {'username': username, 'password': password, 'key': key}
         
         # POST AUTH REQUEST
-        response = requests.post(URL_AUTH, json=login_data)
+        response = self.http.post(URL_AUTH, json=login_data, headers={'Authorization': None})
         response.raise_for_status()
 
         token = response.json()['token']
@@ -157,6 +202,7 @@ class APISession():
         self.password = password
         self.key = key
         self.token = token
+        self.http.headers['Authorization'] = "JWT " + token
 
 
     def _get_endpoint_urls(self, user_url):
@@ -215,12 +261,16 @@ class APISession():
 
     def reset_login(self):
         ""
+        if self._http is not None:
+            self._http.close()
+            self._http = None
         self.instance = None
         self.url = None
         self.username = None
         self.password = None
         self.key = None
         self.token = None
+        self.schema = None
 
 
     def is_logged_in(self):
@@ -305,8 +355,8 @@ def get_init_file():
     """
     if os.path.exists(os.getcwd() + "/" + USER_CONFIG_FILE_NAME):
         return os.getcwd() + "/" + USER_CONFIG_FILE_NAME
-    elif os.path.exists(os.path.expanduser(USER_CONFIG_FILE_PATH )):
-        return os.path.expanduser(USER_CONFIG_FILE_PATH )
+    elif os.path.exists(USER_CONFIG_FILE_PATH):
+        return USER_CONFIG_FILE_PATH
     else:
         for c,d,f in walk_up(os.getcwd()):
             if os.path.exists(c + "/" + USER_CONFIG_FILE_NAME):
@@ -318,9 +368,7 @@ def read_init_file(fpath, instance_name="", endpoint=""):
     parse the credentials file
     """
     config = configparser.ConfigParser()
-    try:
-        config.read(fpath)
-    except:
+    if not fpath or not config.read(fpath):
         printDebug(f"ERROR: `{USER_CONFIG_FILE_NAME}` credentials file not found." , fg="red")
         printDebug("HowTo: https://digital-science.github.io/dimcli/getting-started.html#authentication", fg="red")
         sys.exit(0)
@@ -329,7 +377,7 @@ def read_init_file(fpath, instance_name="", endpoint=""):
     if instance_name:
         try:
             section = config['instance.' + instance_name]
-        except:
+        except KeyError:
             printDebug(f"ERROR: Credentials file `{fpath}` does not contain settings for instance: '{instance_name}''", fg="red")
             printDebug(f"Available instances are:")
             for x in config.sections():
@@ -346,7 +394,7 @@ def read_init_file(fpath, instance_name="", endpoint=""):
                 # print(instance_name, config[instance_name]['url'])
                 if endpoint == config[instance_name]['url']:
                     return config[instance_name]
-            except:
+            except KeyError:
                 pass
         printDebug(f"ERROR: Credentials file `{fpath}` does not contain settings for endpoint: '{endpoint}''", fg="red")        
         sys.exit(0)
@@ -369,8 +417,8 @@ def get_settings_file():
     """
     if os.path.exists(os.getcwd() + "/" + USER_SETTINGS_FILE_NAME):
         return os.getcwd() + "/" + USER_SETTINGS_FILE_NAME
-    elif os.path.exists(os.path.expanduser(USER_SETTINGS_FILE_PATH )):
-        return os.path.expanduser(USER_SETTINGS_FILE_PATH )
+    elif os.path.exists(USER_SETTINGS_FILE_PATH):
+        return USER_SETTINGS_FILE_PATH
     else:
         for c,d,f in walk_up(os.getcwd()):
             if os.path.exists(c + "/" + USER_SETTINGS_FILE_NAME):
@@ -382,16 +430,14 @@ def read_settings_file(fpath, section_name):
     parse the settings file for sections like 'gist' key etc..
     """
     config = configparser.ConfigParser()
-    try:
-        config.read(fpath)
-    except:
+    if not fpath or not config.read(fpath):
         printDebug(f"ERROR: `{USER_SETTINGS_FILE_NAME}` settings file not found." , fg="red")
         printDebug("HowTo: https://digital-science.github.io/dimcli/getting-started.html#github-gists-token", fg="red")
         sys.exit(0)
     # we have a good config file
     try:
         section = config[section_name]
-    except:
+    except KeyError:
         printDebug(f"ERROR: Settings file `{fpath}` does not contain settings for: '{section_name}''", fg="red")
         printDebug("---\nPlease review the file contents, or see https://digital-science.github.io/dimcli/getting-started.html#github-gists-token")
         config.sections()
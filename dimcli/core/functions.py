@@ -7,7 +7,6 @@ NOTE: these objects are attached to the top level ``dimcli.functions`` module. S
 """
 
 import json
-import pandas as pd
 import click
 from tqdm import tqdm
 import time
@@ -251,6 +250,7 @@ def extract_affiliations(affiliations, as_json=False):
     if as_json:
         return output.json
     elif "results" in output.json: # return DF
+        import pandas as pd
         if affiliation_type == "STRUCTURED":
             temp = pd.json_normalize(output.json['results'],  errors='ignore')
         if affiliation_type == "UNSTRUCTURED": 
@@ -551,6 +551,7 @@ def build_reviewers_matrix(abstracts, candidates, max_concepts=15, connector="OR
 
     
     # boostrap matrix table
+    import pandas as pd
     matrix = pd.DataFrame(columns=["researcher"])
     matrix["researcher"] = candidates
 
@@ -5,6 +5,8 @@ NOTE All magic commands results get saved automatically to a variable named ``ds
 
 """
 
+import re
+
 from IPython.core import magic_arguments
 from IPython.core.magic import line_magic, cell_magic, line_cell_magic, Magics, magics_class
 
@@ -16,6 +18,11 @@ from ..core.auth import get_global_connection, is_logged_in_globally as is_logge
 from ..utils.all import *
 
 
+# sources and entities names known to the local DSL grammar (sets, for fast lookups)
+_SOURCES = frozenset(G.sources())
+_ENTITIES = frozenset(G.entities())
+
+
 @magics_class
 class DslMagics(Magics):
 
@@ -45,6 +52,27 @@ class DslMagics(Magics):
         else:
             res = self.dslobject.query_iterative(text)
             return res
+
+
+    def _run(self, line, cell, *, loop=False, as_df=False, gsheets=False):
+        """Shared procedure for all query magics: login, run the query, transform the results and save them to `dsl_last_results`. 
+        
+        Dataframe transformations (`as_df`) work only with `search` queries. If `gsheets` is set, the results are also exported to google sheets and the sheet URL is returned.
+        """
+        if not self._handle_login():
+            return None
+        if cell:
+            line = cell
+        if as_df and not line_is_search_query(line):
+            print("Sorry - DSL to dataframe magic methods work only with `search` queries.")
+            return None
+        data = self._handle_query(line, loop=loop)
+        if as_df:
+            data = data.as_dataframe()
+        self.shell.user_ns[self.results_var] = data
+        if gsheets:
+            return export_as_gsheets(data, line)
+        return data
         
 
     #
@@ -73,13 +101,7 @@ class DslMagics(Magics):
         >>> %dsl search publications for "malaria" return publications limit 500
 
         """
-        if self._handle_login():
-            if cell:
-                line = cell
-            data = self._handle_query(line)
-            self.shell.user_ns[self.results_var] = data
-            return data
-
+        return self._run(line, cell, loop=False, as_df=False, gsheets=False)
 
     @line_cell_magic
     def dsldf(self, line, cell=None):
@@ -102,16 +124,7 @@ class DslMagics(Magics):
         >>> %dsldf search publications for "malaria" return publications limit 500
 
         """
-
-        if self._handle_login():
-            if cell:
-                line = cell
-            if not line_is_search_query(line):
-                print("Sorry - DSL to dataframe magic methods work only with `search` queries.")
-                return None
-            data = self._handle_query(line).as_dataframe()
-            self.shell.user_ns[self.results_var] = data
-            return data
+        return self._run(line, cell, loop=False, as_df=True, gsheets=False)
 
     @line_cell_magic
     def dslgsheets(self, line, cell=None):
@@ -136,15 +149,7 @@ class DslMagics(Magics):
         >>> %dslgsheets search publications for "malaria" return publications limit 500
 
         """
-        if self._handle_login():
-            if cell:
-                line = cell
-            if not line_is_search_query(line):
-                print("Sorry - DSL to dataframe magic methods work only with `search` queries.")
-                return None
-            data = self._handle_query(line).as_dataframe()
-            self.shell.user_ns[self.results_var] = data
-            return export_as_gsheets(data, line)
+        return self._run(line, cell, loop=False, as_df=True, gsheets=True)
 
     @line_cell_magic
     def dslloop(self, line, cell=None):
@@ -169,13 +174,7 @@ class DslMagics(Magics):
         >>> %dslloop search publications for "malaria" where times_cited > 200 return publications 
 
         """
-        if self._handle_login():
-            if cell:
-                line = cell
-            data = self._handle_query(line, loop=True)
-            self.shell.user_ns[self.results_var] = data
-            return data
-
+        return self._run(line, cell, loop=True, as_df=False, gsheets=False)
 
     @line_cell_magic
     def dslloopdf(self, line, cell=None):
@@ -198,15 +197,7 @@ class DslMagics(Magics):
         >>> %dslloopdf search publications for "malaria" where times_cited > 200 return publications 
 
         """
-        if self._handle_login():
-            if cell:
-                line = cell
-            if not line_is_search_query(line):
-                print("Sorry - DSL to dataframe magic methods work only with `search` queries.")
-                return None
-            data = self._handle_query(line, loop=True).as_dataframe()
-            self.shell.user_ns[self.results_var] = data
-            return data
+        return self._run(line, cell, loop=True, as_df=True, gsheets=False)
 
     @line_cell_magic
     def dslloopgsheets(self, line, cell=None):
@@ -230,16 +221,7 @@ class DslMagics(Magics):
         -------
         >>> %dslloopdf search publications for "malaria" where times_cited > 200 return publications 
         """
-        if self._handle_login():
-            if cell:
-                line = cell
-            if not line_is_search_query(line):
-                print("Sorry - DSL to dataframe magic methods work only with `search` queries.")
-                return None
-            data = self._handle_query(line, loop=True).as_dataframe()
-            self.shell.user_ns[self.results_var] = data
-            return export_as_gsheets(data, line)
-
+        return self._run(line, cell, loop=True, as_df=True, gsheets=True)
 
     @line_cell_magic
     def extract_concepts(self, line, cell=None):
@@ -330,29 +312,28 @@ class DslMagics(Magics):
 
         try:
             import pandas as pd
-            df = pd.DataFrame()
         except:
             print("Sorry this functionality requires the Pandas python library. Please install it first")
             return
 
         obj = line.strip()
-        if obj and obj not in G.entities() and obj not in G.sources():
+        if obj and obj not in _ENTITIES and obj not in _SOURCES:
             sou = " - ".join([x for x in G.sources()])
             ent = " - ".join([x for x in G.entities()])
             print(f"Can't recognize this object. Dimcli knows about:\n Sources=[{sou}] Entities=[{ent}] ")
             # continue anyways
         
-        res = self._handle_query(f"describe schema") # same query for all requests (filtering done here)
+        schema = self.dslobject._get_schema() # same query for all requests (filtering done here)
 
         if not obj:
             # show data for all sources
             docs_for = G.sources()
             header = "sources"
-        elif obj in G.entities():
+        elif obj in _ENTITIES:
             # match single entity
             docs_for = [obj]
             header = "entities"
-        elif obj in G.sources():
+        elif obj in _SOURCES:
             # match single source
             docs_for = [obj]
             header = "sources"
@@ -363,16 +344,17 @@ class DslMagics(Magics):
 
         d = {header: [], 'field': [], 'type': [], 'description':[], 'is_filter':[], 'is_entity': [],  'is_facet':[],}
         for S in docs_for:
-            for x in sorted(res.json[header][S]['fields']):
-                d[header] += [S]
-                d['field'] += [x]
-                d['type'] += [res.json[header][S]['fields'][x]['type']]
-                d['description'] += [res.json[header][S]['fields'][x]['description']]
-                d['is_filter'] += [res.json[header][S]['fields'][x]['is_filter']]
-                d['is_facet'] += [res.json[header][S]['fields'][x].get('is_facet', False)]
-                d['is_entity'] += [res.json[header][S]['fields'][x].get('is_entity', False)]
-
-        data = df.from_dict(d)
+            meta = schema[header][S]['fields']
+            fields = sorted(meta)
+            d[header].extend([S] * len(fields))
+            d['field'].extend(fields)
+            d['type'].extend([meta[x]['type'] for x in fields])
+            d['description'].extend([meta[x]['description'] for x in fields])
+            d['is_filter'].extend([meta[x]['is_filter'] for x in fields])
+            d['is_facet'].extend([meta[x].get('is_facet', False) for x in fields])
+            d['is_entity'].extend([meta[x].get('is_entity', False) for x in fields])
+
+        data = pd.DataFrame(d)
         self.shell.user_ns[self.results_var] = data
         return data
 
@@ -382,6 +364,10 @@ class DslMagics(Magics):
 from ..repl.autocompletion import CleverCompleter
 from prompt_toolkit.document import Document
 
+# query magics that get DSL autocompletion, eg `%dsl`, `%%dslloopdf` (longest names first)
+_DSL_CMD_RE = re.compile(r'^%{1,2}(dslloopgsheets|dslloopdf|dslloop|dslgsheets|dsldf|dsl)\b')
+_COMPLETER = CleverCompleter()
+
 def _load_ipython_custom_completers(ipython):
     """
 
@@ -407,15 +393,13 @@ def _load_ipython_custom_completers(ipython):
         # print(dir(event), event)
 
         # FIXME only first line gets the autocomplete!
-        if event.line.startswith("%%"):
-            event.line = event.line[1:] #  reduce cell symbol (double %) to line symbol
-        for command in ["%dslloopdf", "%dsldf", "%dslloop", "%dsl"]:
-            if command in event.line: # first match will return results
-                doc = Document(event.line.replace(command, ""))
-                c = CleverCompleter()
-                res = c.get_completions(doc, None)
-                # print(res)
-                return [x.text for x in res]
+        m = _DSL_CMD_RE.match(event.line)
+        if not m:
+            return
+        doc = Document(event.line[m.end():])
+        res = _COMPLETER.get_completions(doc, None)
+        # print(res)
+        return [x.text for x in res]
             
     def dsldocs_completers(self, event):
         """ 
@@ -425,17 +409,14 @@ def _load_ipython_custom_completers(ipython):
         command = "%dsldocs"
         if event.line.startswith(command):
             doc = Document(event.line.replace(command, ".docs"))
-            c = CleverCompleter()
-            res = c.get_completions(doc, None)
+            res = _COMPLETER.get_completions(doc, None)
             # print(res)
             return [x.text for x in res]           
 
     
     # loader
 
-    for command in ["%dslloop_to_dataframe", "%dsl_to_dataframe", "%dslloop", "%dsl"]:
-        ipython.set_hook('complete_command', dslq_completers, re_key = command)
-        ipython.set_hook('complete_command', dslq_completers, re_key = "%" + command)
+    ipython.set_hook('complete_command', dslq_completers, re_key = _DSL_CMD_RE.pattern)
 
     ipython.set_hook('complete_command', dsldocs_completers, re_key = "%dsldocs")
 
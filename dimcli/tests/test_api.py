@@ -0,0 +1,203 @@
+# !/usr/bin/env python
+#  -*- coding: UTF-8 -*-
+"""
+Unit tests for Dimcli - Dsl client logic (offline: API calls are simulated)
+
+python -m dimcli.tests.test_api
+
+"""
+
+from __future__ import print_function
+
+import unittest, os, sys, click
+import re
+import threading
+from unittest import mock
+import requests
+
+from ..core import api
+from ..core.api import Dsl, DslDataset, QUERY_MAX_ATTEMPTS
+
+
+class FakeConnection(object):
+    """Stands in for a logged in APISession: no HTTP calls are made."""
+    token = "fake-token"
+    url = "https://fake.dimensions.ai/api/dsl/v2"
+    schema = None
+
+    def __init__(self):
+        self.http = mock.Mock() # tests set `http.post.side_effect` to the responses they need
+        self.refresh_login = mock.Mock()
+
+
+def fake_response(status_code, body=b"{}", headers=None):
+    """Build a `requests.Response` as returned by the API, without any network access."""
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = body
+    response.headers.update({"Content-Length": str(len(body))})
+    response.headers.update(headers or {})
+    response.url = FakeConnection.url
+    return response
+
+
+def fake_pages(total, errors_at=(), warnings_at=()):
+    """Return a fake `Dsl.query` method serving `total` publications, one page per limit/skip.
+
+    Pages starting at the offsets in `errors_at` return an API error; the ones in `warnings_at` return a warning.
+    """
+    lock = threading.Lock()
+    calls = []
+    def query(self, q, show_results=None, retry=0, verbose=None):
+        limit, skip = [int(x) for x in re.search(r"limit (\d+) skip (\d+)", q).groups()]
+        with lock:
+            calls.append((skip, limit))
+        if skip in errors_at:
+            return DslDataset({"errors": {"query": {"header": "Semantic errors found:\n", "details": [f"page {skip}"]}}})
+        data = {
+            "_stats": {"total_count": total},
+            "publications": [{"id": f"pub.{x}"} for x in range(skip, min(skip + limit, total))],
+        }
+        if skip in warnings_at:
+            data["_warnings"] = [f"warning at {skip}"]
+        return DslDataset(data)
+    query.calls = calls
+    return query
+
+
+class TestOne(unittest.TestCase):
+
+    """
+    Tests - iterative queries with concurrent pages 
+    """
+
+    click.secho("**test_api.py**", fg="red")
+    Q = """search publications for "graphene" return publications"""
+
+    def _run(self, fake, workers=4, **kwargs):
+        d = Dsl(verbose=False, auth_session=FakeConnection())
+        with mock.patch.object(Dsl, "query", fake):
+            return d.query_iterative(self.Q, pause=0, workers=workers, **kwargs)
+
+    def test_001(self):
+        click.secho("\nTEST 001: Concurrent pages are merged in offset order.", bg="green")
+        # ----
+        fake = fake_pages(2500, warnings_at=(1000, 2000))
+        res = self._run(fake, limit=100)
+        print(" ==> len(res): ", len(res))
+        print(" ==> res['stats']: ", res['stats'])
+        self.assertEqual([x['id'] for x in res.publications], [f"pub.{x}" for x in range(2500)])
+        self.assertEqual(res['stats']['total_count'], 2500)
+        self.assertEqual(sorted(fake.calls), [(x, 100) for x in range(0, 2500, 100)])
+        self.assertEqual(res['_warnings'], ["warning at 1000", "warning at 2000"])
+        # ----
+        click.secho("Completed test succesfully", fg="green")
+
+    def test_002(self):
+        click.secho("\nTEST 002: Concurrent pages stop at maxlimit.", bg="green")
+        # ----
+        fake = fake_pages(5000)
+        res = self._run(fake, limit=1000, maxlimit=2500)
+        print(" ==> len(res): ", len(res))
+        self.assertEqual(len(res.publications), 2500)
+        self.assertEqual(sorted(fake.calls), [(0, 1000), (1000, 1000), (2000, 500)])
+        # ----
+        click.secho("Completed test succesfully", fg="green")
+
+    def test_003(self):
+        click.secho("\nTEST 003: Concurrent pages with errors.", bg="green")
+        # ----
+        click.secho("force=True skips the failed page", fg="magenta")
+        res = self._run(fake_pages(500, errors_at=(200,)), limit=100, force=True)
+        print(" ==> len(res): ", len(res))
+        self.assertEqual([x['id'] for x in res.publications], [f"pub.{x}" for x in range(500) if not 200 <= x < 300])
+        # ----
+        click.secho("force=False returns the error", fg="magenta")
+        res = self._run(fake_pages(500, errors_at=(200,)), limit=100)
+        self.assertTrue(res['errors'])
+        self.assertEqual(res.errors_string, "Semantic errors found:\npage 200")
+        # ----
+        click.secho("HTTP errors are raised", fg="magenta")
+        pages = fake_pages(500)
+        def fake(self, q, **kwargs):
+            if "skip 300" in q:
+                raise requests.HTTPError("429 Client Error: Too Many Requests")
+            return pages(self, q, **kwargs)
+        with self.assertRaises(requests.HTTPError):
+            self._run(fake, limit=100)
+        with self.assertRaises(requests.HTTPError):
+            self._run(fake, workers=1, limit=100)
+        # ----
+        click.secho("Completed test succesfully", fg="green")
+
+
+
+class TestTwo(unittest.TestCase):
+
+    """
+    Tests - query retries (429 throttling, 403 expired token, other HTTP errors)
+    """
+
+    Q = """search publications for "graphene" return publications limit 1"""
+    OK = b'{"_stats": {"total_count": 1}, "publications": [{"id": "pub.1"}]}'
+
+    def _dsl(self, responses):
+        conn = FakeConnection()
+        conn.http.post.side_effect = responses
+        return Dsl(verbose=False, auth_session=conn), conn
+
+    def test_001(self):
+        click.secho("\nTEST 001: 429 responses honour Retry-After.", bg="green")
+        # ----
+        d, conn = self._dsl([fake_response(429, headers={"Retry-After": "3"}), fake_response(200, self.OK)])
+        with mock.patch.object(api.time, "sleep") as sleep:
+            res = d.query(self.Q, verbose=False)
+        print(" ==> sleep calls: ", sleep.call_args_list)
+        self.assertEqual(res.publications, [{"id": "pub.1"}])
+        sleep.assert_called_once_with(3.0)
+        self.assertEqual(conn.http.post.call_count, 2)
+        # ----
+        click.secho("Completed test succesfully", fg="green")
+
+    def test_002(self):
+        click.secho("\nTEST 002: 403 responses log in again.", bg="green")
+        # ----
+        d, conn = self._dsl([fake_response(403), fake_response(200, self.OK)])
+        with mock.patch.object(api.time, "sleep") as sleep:
+            res = d.query(self.Q, verbose=False)
+        self.assertEqual(res.publications, [{"id": "pub.1"}])
+        conn.refresh_login.assert_called_once_with()
+        sleep.assert_not_called()
+        # ----
+        click.secho("Completed test succesfully", fg="green")
+
+    def test_003(self):
+        click.secho("\nTEST 003: Too many 429 responses raise an HTTPError.", bg="green")
+        # ----
+        d, conn = self._dsl([fake_response(429) for x in range(QUERY_MAX_ATTEMPTS)])
+        with mock.patch.object(api.time, "sleep") as sleep:
+            with self.assertRaises(requests.HTTPError) as cm:
+                d.query(self.Q, verbose=False)
+        print(" ==> ", cm.exception)
+        self.assertEqual(conn.http.post.call_count, QUERY_MAX_ATTEMPTS)
+        self.assertEqual(sleep.call_count, QUERY_MAX_ATTEMPTS - 1)
+        # ----
+        click.secho("Completed test succesfully", fg="green")
+
+    def test_004(self):
+        click.secho("\nTEST 004: Other HTTP errors are retried `retry` times.", bg="green")
+        # ----
+        d, conn = self._dsl([fake_response(502) for x in range(QUERY_MAX_ATTEMPTS)])
+        with mock.patch.object(api.time, "sleep") as sleep:
+            with self.assertRaises(requests.HTTPError) as cm:
+                d.query(self.Q, verbose=False, retry=2)
+        print(" ==> ", cm.exception)
+        self.assertEqual(conn.http.post.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+        # ----
+        click.secho("Completed test succesfully", fg="green")
+
+
+
+if __name__ == "__main__":
+    unittest.main()
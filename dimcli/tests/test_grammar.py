@@ -10,9 +10,10 @@ from __future__ import print_function
 
 import unittest, os, sys, click
 import configparser
+import copy
 
 from .. import *
-from ..core.auth import USER_CONFIG_FILE_PATH
+from ..core.auth import USER_CONFIG_FILE_PATH, APISession
 from ..utils import *
 
 from .settings import API_INSTANCE
@@ -110,5 +111,45 @@ class TestOne(unittest.TestCase):
         click.secho("Completed test succesfully", fg="green")
 
 
+    def test_004(self):
+        click.secho("\nTEST 004: Client-side validation of search queries (no API calls).", bg="green")
+        # a logged in session whose API schema is newer than the local grammar
+        session = APISession()
+        session.token, session.url = "fake-token", "https://fake.dimensions.ai/api/dsl/v2"
+        session.schema = copy.deepcopy(G.grammar)
+        session.schema['sources']['publications']['fields']['category_for_2020'] = {"type": "categories", "is_facet": True, "is_filter": True}
+        d = Dsl(verbose=False, auth_session=session)
+        # ----
+        for q in [
+            """search publications for "malaria" return publications""",
+            """search publications for "malaria" return publications[id+title] limit 10""",
+            """search publications for "\\"return to work\\"" return publications""",
+            """search publications where title="return nothing" return publications""",
+            """search publications return in "facets" funders""",
+            """search publications for "malaria" return category_for_2020""",
+            """search publications for "unbalanced return nothing""",
+            """describe source publications""",
+        ]:
+            click.secho(q, fg="magenta")
+            self.assertIsNone(d._validate_query(q))
+        # ----
+        for q in [
+            """search publicationz for "malaria" return publications""",
+            'search publications for "malaria"',
+            'search publications for "return publications"',
+            """search publications for "malaria" return fundrs""",
+        ]:
+            click.secho(q, fg="magenta")
+            error = d._validate_query(q)
+            print(" ==> ", error)
+            self.assertTrue(error)
+        # ----
+        click.secho("Without a schema, queries are never rejected", fg="magenta")
+        d = Dsl(verbose=False, auth_session=APISession())
+        self.assertIsNone(d._validate_query("""search publicationz for "malaria" return publications"""))
+        # ----
+        click.secho("Completed test succesfully", fg="green")
+
+
 if __name__ == "__main__":
     unittest.main()
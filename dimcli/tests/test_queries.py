@@ -108,6 +108,16 @@ class TestOne(unittest.TestCase):
         print("WARNINGS [{}]".format(len(res["_warnings"])))
         print("\n".join([s for s in res["_warnings"]]))
         # ----
+        click.secho("\nTEST 001-F: Iterative querying with concurrent pages (workers=4)", bg="green")
+        # ----
+        d = Dsl()
+        q = """search publications where journal.title="nature medicine" and year>2015 return publications"""
+        res = d.query_iterative(q, workers=4)
+        click.secho("Query results: ", fg="magenta")
+        print(" ==> len(res): ", len(res))
+        print(" ==> res['stats']: ", res['stats'])
+        assert len(res) == res['stats']['total_count']
+        # ----
         click.secho("Completed test succesfully", fg="green")
 
 
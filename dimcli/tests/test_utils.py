@@ -0,0 +1,50 @@
+# !/usr/bin/env python
+#  -*- coding: UTF-8 -*-
+"""
+Unit tests for Dimcli - utilities (offline, no API login needed)
+
+python -m dimcli.tests.test_utils
+
+"""
+
+from __future__ import print_function
+
+import unittest, os, sys, click
+
+from ..utils import misc_utils
+from ..utils import *
+
+
+class TestOne(unittest.TestCase):
+
+    """
+    Tests - utilities
+    """
+
+    click.secho("**test_utils.py**", fg="red")
+
+    def test_001(self):
+        click.secho("\nTEST 001: chunks_of.", bg="green")
+        # ----
+        res = list(chunks_of(list(range(7)), 3))
+        print(" ==> chunks_of(range(7), 3): ", res)
+        self.assertEqual(res, [(0, 1, 2), (3, 4, 5), (6,)])
+        self.assertEqual({type(x) for x in res}, {tuple})
+        self.assertEqual(list(chunks_of([], 3)), [])
+        # also works with any iterable, not just sequences
+        self.assertEqual(list(chunks_of(iter("abcde"), 2)), [("a", "b"), ("c", "d"), ("e",)])
+        # ----
+        click.secho("Same results without itertools.batched (python < 3.12)", fg="magenta")
+        _batched, misc_utils._batched = misc_utils._batched, None
+        try:
+            self.assertEqual(list(chunks_of(list(range(7)), 3)), [(0, 1, 2), (3, 4, 5), (6,)])
+            self.assertEqual(list(chunks_of([], 3)), [])
+        finally:
+            misc_utils._batched = _batched
+        # ----
+        click.secho("Completed test succesfully", fg="green")
+
+
+
+if __name__ == "__main__":
+    unittest.main()
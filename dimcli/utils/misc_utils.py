@@ -17,12 +17,11 @@ import os
 import re
 import webbrowser
 from itertools import islice
-
-from pandas import DataFrame
 try:
-    from pandas import json_normalize
-except:
-    from pandas.io.json import json_normalize
+    from itertools import batched as _batched # python 3.12+
+except ImportError:
+    _batched = None
+
 
 
 
@@ -39,7 +38,7 @@ def chunks_of(data, size):
     Returns
     -------
     Iterator
-        An iterable
+        An iterable of tuples
 
     Example
     -------
@@ -50,14 +49,13 @@ def chunks_of(data, size):
     5
     5
     >>> list(chunks_of(a, 5))
-    [[0, 1, 2, 3, 4], [5, 6, 7, 8, 9]]
+    [(0, 1, 2, 3, 4), (5, 6, 7, 8, 9)]
 
     """
+    if _batched is not None:
+        return _batched(data, size)
     it = iter(data)
-    chunk = list(islice(it, size))
-    while chunk:
-        yield chunk
-        chunk = list(islice(it, size))
+    return iter(lambda: tuple(islice(it, size)), ())
 
 
 def save2File(contents, filename, path):
@@ -229,6 +227,7 @@ def export_as_gsheets(input_data, query="", title=None, verbose=True):
     Saved:
     https://docs.google.com/spreadsheets/d/1tsyRFDEsADltWDdqjuyDWDOg81sl9hN3Nu8MXVlqDDI
     """
+    from pandas import DataFrame, json_normalize
 
     if 'google.colab' in sys.modules:
         from google.colab import auth
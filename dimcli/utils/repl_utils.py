@@ -13,12 +13,8 @@ import os
 import re
 import webbrowser
 import textwrap
+import functools
 from itertools import islice
-from pandas import DataFrame
-try:
-    from pandas import json_normalize
-except:
-    from pandas.io.json import json_normalize
 
 from ..core.dsl_grammar import *
 from ..core.auth import USER_HISTORY_FILE
@@ -207,6 +203,7 @@ def line_for_text_is_complete(line):
         if l[-1].count("\"") > 1 and l[-1].strip()[-1] == "\"":
             return True
 
+@functools.lru_cache(maxsize=256)
 def line_is_search_query(line):
     "checks if it is a `search` query"
     l = line.strip().split()
@@ -263,6 +260,7 @@ def line_search_aggregates(line):
     else:
         return None
 
+@functools.lru_cache(maxsize=256)
 def line_add_lazy_return(text):
     "if return statement not included, add it lazily"
     if "return" not in text:
@@ -272,6 +270,7 @@ def line_add_lazy_return(text):
             return text.strip() + " return " + source
     return text
 
+@functools.lru_cache(maxsize=256)
 def line_add_lazy_describe(line):
     "if describe has no arguments, default silently to <describe version>"
     l = line.split()
@@ -352,6 +351,7 @@ def init_exports_folder(export_dir):
 
 def export_json_csv(jjson, query, USER_EXPORTS_DIR):
     """Export to a CSV"""
+    from pandas import json_normalize
     return_object = line_search_return(query)
     try:
         df =  json_normalize(jjson[return_object], errors="ignore")
@@ -402,6 +402,7 @@ def export_gist(jjson, query, api_endpoint):
 
     This generated a header file in markdown, a JSON file and also a CSV export.
     """
+    from pandas import json_normalize
 
 
     nicetime = time.strftime("%Y-%m-%d %H:%M:%S")
@@ -478,6 +479,7 @@ def export_as_bar_chart(jjson, query, USER_EXPORTS_DIR):
     requires the plotly library, which is not installed by default
 
     """
+    from pandas import json_normalize
 
     try:
         import plotly.express as px
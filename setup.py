@@ -61,6 +61,9 @@ setup(
     },
     data_files=[('*', ['requirements.txt'])],
     install_requires=REQUIREMENTS_DATA,
+    extras_require={
+        "fast": ["ijson>=3.1", "orjson", "brotli"],
+    },
     entry_points="""
         [console_scripts]
         dimcli = dimcli.main_cli:main_cli